@@ -1,4 +1,5 @@
-import os, re, ssl, smtplib, json, random, time, traceback
+import os, re, ssl, smtplib, json, random, time, traceback, shutil, hashlib, tempfile
+from datetime import date, datetime, timedelta
 from pathlib import Path
 from email.mime.text import MIMEText
 import yaml
@@ -12,8 +13,30 @@ ROOT = Path(__file__).parent
 STATE_FILE = ROOT / "storage_state.json"     # Playwright session (persisted to repo)
 SEEN_FILE  = ROOT / "seen_ids.json"          # Last-seen Request IDs (persisted to repo)
 RULES_FILE = ROOT / "rules.yaml"
+SELECTOR_CACHE_FILE = ROOT / "selector_cache.json"  # Winning login selectors per role (persisted to repo)
+PERIOD_STATS_FILE = ROOT / "period_stats.json"      # Priority matches per period label (persisted to repo)
+CHECKPOINT_FILE = ROOT / "run_checkpoint.json"      # Progress of an unfinished scrape (persisted to repo)
 ARTIFACTS_DIR = ROOT / "artifacts"
 VIDEO_TEMP_DIR = ARTIFACTS_DIR / "video"
+PROFILE_DIR = ROOT / ".browser-profile"             # Chromium user-data dir (restored via actions/cache)
+PROFILE_MARKER = PROFILE_DIR / "scraper-profile.json"
+
+# Persistent profile: keeps Chromium's HTTP cache, service workers and IndexedDB between runs
+USE_PERSISTENT_PROFILE = (os.environ.get("PERSISTENT_PROFILE") or "").lower() in ("1", "true", "yes")
+PROFILE_MAX_MB = int(os.environ.get("PROFILE_MAX_MB") or 300)
+PROFILE_DISK_CACHE_MB = int(os.environ.get("PROFILE_DISK_CACHE_MB") or 150)
+# Cache subdirectories that are safe to drop when the profile grows too large
+PROFILE_PRUNABLE = [
+    "Default/Cache",
+    "Default/Code Cache",
+    "Default/GPUCache",
+    "Default/Service Worker/CacheStorage",
+    "Default/Service Worker/ScriptCache",
+    "GrShaderCache",
+    "ShaderCache",
+]
+# Left behind when a run is killed mid-flight; Chromium refuses to start while they exist
+PROFILE_LOCKS = ["SingletonLock", "SingletonSocket", "SingletonCookie"]
 
 USER_AGENTS = [
     # keep a few realistic UAs; Playwright already does a lot, this just adds variation
@@ -22,6 +45,35 @@ USER_AGENTS = [
     "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36",
 ]
 
+# Candidate selectors per login role; resolve_visible races them and caches the winner.
+WELCOME_SELECTORS = [
+    "role=button[name=/log.?in/i]",
+    "role=link[name=/^log.?in$/i]",
+    "input[type='submit'][value*='log' i]",
+]
+EMAIL_SELECTORS = [
+    "input[type='email']",
+    "input[name='email']",
+    "input[autocomplete='username']",
+    "input[type='text'][name='username']",
+    ".auth0-lock-input input",
+]
+PASSWORD_SELECTORS = [
+    "input[type='password']",
+    "input[name='password']",
+    ".auth0-lock-input input[type='password']",
+]
+SUBMIT_SELECTORS = [
+    "role=button[name=/^log.?in$/i]",
+    ".auth0-lock-submit button",
+    "button[type='submit']",
+]
+ERROR_SELECTORS = [
+    ".auth0-global-message-error",
+    ".auth0-lock-error-msg",
+    "text=/(invalid|wrong|try again)/i",
+]
+
 def jitter_sleep():
     # Shorter, still human-like jitter: 4–37 seconds
     delay = random.uniform(4, 37)
@@ -32,6 +84,46 @@ def jitter_sleep():
 def micro_pause():
     time.sleep(random.uniform(0.3, 1.1))
 
+# Whole-run budget. The next scheduled run (every 10 minutes, cancel-in-progress) ends
+# this one, and setup plus the post-run steps share those 10 minutes; see scraper.yml.
+RUN_BUDGET_SECONDS = float(os.environ.get("RUN_BUDGET_SECONDS") or 330)
+RUN_RESERVE_SECONDS = 30   # kept back for alert flush, state save and browser shutdown
+PERIOD_SWITCH_SECONDS = 20 # don't start a new period with less than this left
+LOGIN_MIN_SECONDS = 45     # a (re-)login needs at least this much of the phase left
+PHASE_BUDGETS = {"login": 150, "navigate": 60, "scrape": None}  # None = rest of the run
+
+class RunDeadline:
+    # Tracks the run deadline and the current phase's slice of it. wait_ms() shrinks
+    # Playwright timeouts as either gets close, so a stuck wait can't eat the run.
+    def __init__(self, total_seconds=None):
+        self.start(total_seconds)
+
+    def start(self, total_seconds):
+        self.end = time.monotonic() + total_seconds if total_seconds else None
+        self.phase_name = None
+        self.phase_end = self.end
+
+    def phase(self, name, seconds=None):
+        now = time.monotonic()
+        hard_end = self.end - RUN_RESERVE_SECONDS if self.end is not None else None
+        ends = [e for e in (hard_end, now + seconds if seconds else None) if e is not None]
+        self.phase_name = name
+        self.phase_end = min(ends) if ends else None
+        print(f"deadline: phase '{name}' has {self.remaining():.0f}s")
+
+    def remaining(self):
+        if self.phase_end is None:
+            return float("inf")
+        return max(0.0, self.phase_end - time.monotonic())
+
+    def expired(self, margin=0):
+        return self.remaining() <= margin
+
+    def wait_ms(self, cap_ms, floor_ms=1000):
+        return int(max(floor_ms, min(cap_ms, self.remaining() * 1000)))
+
+run_deadline = RunDeadline()
+
 def ensure_artifact_dirs():
     ARTIFACTS_DIR.mkdir(parents=True, exist_ok=True)
     VIDEO_TEMP_DIR.mkdir(parents=True, exist_ok=True)
@@ -50,10 +142,92 @@ def capture_artifacts(page, name):
     except Exception as exc:
         print(f"artifact capture failed for {name}.html: {exc}")
 
+# Defaults for the optional `periods:` block in rules.yaml
+PERIOD_DEFAULTS = {
+    "days_back": 0,              # skip periods that ended more than this many days ago
+    "horizon_days": 84,          # skip periods starting more than this many days ahead
+    "order": "weighted",         # weighted | nearest | page
+    "time_budget_seconds": None, # stop starting new periods once this much scrape time is used
+    "rescan_top": 1,             # top-ranked periods scraped every run, even mid-cycle
+}
+PERIOD_STATS_DECAY = 0.9   # per day since a period's last new priority match
+
 def load_rules():
     with open(RULES_FILE, "r", encoding="utf-8") as f:
         return yaml.safe_load(f).get("rules", [])
 
+def load_period_config():
+    with open(RULES_FILE, "r", encoding="utf-8") as f:
+        cfg = (yaml.safe_load(f) or {}).get("periods") or {}
+    return {k: cfg.get(k, v) for k, v in PERIOD_DEFAULTS.items()}
+
+def load_period_stats():
+    if PERIOD_STATS_FILE.exists():
+        try:
+            data = json.loads(PERIOD_STATS_FILE.read_text())
+            return data if isinstance(data, dict) else {}
+        except Exception:
+            return {}
+    return {}
+
+def save_period_stats(stats):
+    write_json_if_changed(PERIOD_STATS_FILE, stats, indent=2, sort_keys=True)
+
+def period_score(stats, label, today=None):
+    # Stored as {"score": s, "day": "YYYY-MM-DD"}; decay is applied when read, so the
+    # file only changes when a period produces a new priority match.
+    entry = stats.get(label)
+    if not isinstance(entry, dict):
+        return 0.0
+    try:
+        days = ((today or date.today()) - date.fromisoformat(entry["day"])).days
+        return float(entry["score"]) * PERIOD_STATS_DECAY ** max(0, days)
+    except Exception:
+        return 0.0
+
+def update_period_stats(stats, hits, today=None):
+    # Periods that keep producing new priority shifts are scraped first on later runs.
+    if not hits:
+        return stats
+    today = today or date.today()
+    updated = {}
+    for label in stats:
+        if period_score(stats, label, today) >= 0.05:
+            updated[label] = stats[label]
+    for label, n in hits.items():
+        updated[label] = {"score": round(period_score(stats, label, today) + n, 3), "day": today.isoformat()}
+    return updated
+
+def atomic_write_text(path, text):
+    # temp file in the same directory + rename, so a killed run never leaves a torn file
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            fh.write(text)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, path)
+    except Exception:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+def content_hash(data, normalize=None):
+    data = normalize(data) if normalize else data
+    return hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def read_json(path):
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+
+def write_json_if_changed(path, data, normalize=None, **dump_kwargs):
+    # Returns True if the file was written.
+    if path.exists() and content_hash(read_json(path), normalize) == content_hash(data, normalize):
+        return False
+    atomic_write_text(path, json.dumps(data, ensure_ascii=False, **dump_kwargs))
+    return True
+
 def load_seen():
     if SEEN_FILE.exists():
         try:
@@ -63,7 +237,144 @@ def load_seen():
     return set()
 
 def save_seen(ids):
-    SEEN_FILE.write_text(json.dumps(sorted(ids), ensure_ascii=False))
+    atomic_write_text(SEEN_FILE, json.dumps(sorted(ids), ensure_ascii=False))
+
+# Session entries that churn on every visit without affecting auth: analytics and
+# load-balancer affinity cookies, the per-form CSRF cookie, Pendo localStorage.
+VOLATILE_COOKIES = re.compile(r"^(_ga|_gid|_gat|_hj|_pendo|ai_|_csrf$|INGRESSCOOKIE$|srv_id$)", re.I)
+VOLATILE_STORAGE_KEYS = re.compile(r"^_pendo_", re.I)
+
+def normalize_session(state):
+    # What counts as a session change: volatile entries dropped, cookie expiry to the day.
+    state = state or {}
+    cookies = []
+    for c in state.get("cookies", []):
+        if VOLATILE_COOKIES.match(c.get("name", "")):
+            continue
+        c = dict(c)
+        if (c.get("expires") or -1) > 0:
+            c["expires"] = int(c["expires"] // 86400)
+        cookies.append(c)
+    cookies.sort(key=lambda c: (c.get("domain", ""), c.get("path", ""), c.get("name", "")))
+    origins = []
+    for o in state.get("origins", []):
+        items = sorted(
+            (i["name"], i["value"]) for i in o.get("localStorage", [])
+            if not VOLATILE_STORAGE_KEYS.match(i.get("name", ""))
+        )
+        origins.append({"origin": o.get("origin"), "localStorage": items})
+    origins.sort(key=lambda o: o["origin"] or "")
+    return {"cookies": cookies, "origins": origins}
+
+class StateManager:
+    # In-memory owner of SEEN_FILE and STATE_FILE. Nothing is written until commit(),
+    # and then only files whose meaningful content differs from what was loaded.
+    def __init__(self):
+        self.seen = load_seen()
+        self.session = read_json(STATE_FILE) if STATE_FILE.exists() else None
+        self._saved = {
+            "seen": content_hash(sorted(self.seen)),
+            "session": content_hash(self.session, normalize_session) if self.session else None,
+        }
+
+    def capture_session(self, context):
+        try:
+            self.session = context.storage_state()
+        except Exception as exc:
+            print(f"session capture failed: {exc}")
+
+    def commit_seen(self):
+        digest = content_hash(sorted(self.seen))
+        if digest == self._saved["seen"]:
+            return False
+        save_seen(self.seen)
+        self._saved["seen"] = digest
+        return True
+
+    def commit_session(self):
+        if not self.session:
+            return False
+        digest = content_hash(self.session, normalize_session)
+        if digest == self._saved["session"]:
+            return False
+        atomic_write_text(STATE_FILE, json.dumps(self.session, ensure_ascii=False))
+        self._saved["session"] = digest
+        return True
+
+    def commit(self):
+        wrote = [name for name, changed in (("seen", self.commit_seen()), ("session", self.commit_session())) if changed]
+        print(f"state: wrote {', '.join(wrote)}" if wrote else "state: unchanged, nothing written")
+
+def load_selector_cache():
+    if SELECTOR_CACHE_FILE.exists():
+        try:
+            data = json.loads(SELECTOR_CACHE_FILE.read_text())
+            return data if isinstance(data, dict) else {}
+        except Exception:
+            return {}
+    return {}
+
+def save_selector_cache(cache):
+    write_json_if_changed(SELECTOR_CACHE_FILE, cache, indent=2, sort_keys=True)
+
+def resolve_visible(role, selectors, scopes, timeout_ms, cache):
+    # Poll every candidate together rather than waiting on each in turn, so a stale
+    # selector can't burn a whole timeout. Last run's winner for `role` goes first.
+    # timeout_ms=0 means a single non-blocking pass.
+    cached = cache.get(role)
+    ordered = ([cached] if cached in selectors else []) + [s for s in selectors if s != cached]
+    deadline = time.monotonic() + max(0, timeout_ms) / 1000
+    while True:
+        for sel in ordered:
+            for scope in scopes:
+                if scope is None:
+                    continue
+                try:
+                    locator = scope.locator(sel)
+                    count = locator.count()
+                except Exception:
+                    continue
+                for idx in range(count):
+                    candidate = locator.nth(idx)
+                    try:
+                        if candidate.is_visible():
+                            if cache.get(role) != sel:
+                                cache[role] = sel
+                                try:
+                                    save_selector_cache(cache)
+                                except Exception as exc:
+                                    print(f"selector cache save failed: {exc}")
+                            print(f"selector: {role} -> {sel}")
+                            return candidate
+                    except Exception:
+                        continue
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(0.15)
+
+CHECKPOINT_MAX_AGE_SECONDS = 3 * 3600  # older progress is stale; start the cycle again
+
+def empty_checkpoint():
+    return {"updated": None, "periods_done": [], "current": None, "rows": []}
+
+def load_checkpoint():
+    if CHECKPOINT_FILE.exists():
+        try:
+            data = json.loads(CHECKPOINT_FILE.read_text())
+            if data.get("updated") and time.time() - float(data["updated"]) <= CHECKPOINT_MAX_AGE_SECONDS:
+                return {**empty_checkpoint(), **data}
+        except Exception:
+            pass
+    return empty_checkpoint()
+
+def _checkpoint_progress(checkpoint):
+    # the timestamp alone is not a change worth writing (or committing)
+    return {k: v for k, v in (checkpoint or {}).items() if k not in ("updated", "complete")}
+
+def save_checkpoint(checkpoint):
+    if checkpoint.get("rows") or checkpoint.get("periods_done") or checkpoint.get("current"):
+        checkpoint["updated"] = time.time()
+    write_json_if_changed(CHECKPOINT_FILE, checkpoint, normalize=_checkpoint_progress)
 
 def fmt_ul(rows):
     lis = "".join(
@@ -80,22 +391,133 @@ def send_email(subject, html):
     msg["Subject"] = subject
     ctx = ssl.create_default_context()
     port = int(os.environ.get("SMTP_PORT") or 465)
-    with smtplib.SMTP_SSL(os.environ["SMTP_HOST"], port, context=ctx) as s:
+    with smtplib.SMTP_SSL(os.environ["SMTP_HOST"], port, context=ctx, timeout=30) as s:
         s.login(os.environ["SMTP_USER"], os.environ["SMTP_PASS"])
         s.sendmail(msg["From"], [msg["To"]], msg.as_string())
 
+def _dir_size_mb(path):
+    total = 0
+    for f in path.rglob("*"):
+        try:
+            if f.is_file() and not f.is_symlink():
+                total += f.stat().st_size
+        except OSError:
+            continue
+    return total / (1024 * 1024)
+
+def _playwright_version():
+    try:
+        from importlib.metadata import version
+        return version("playwright")
+    except Exception:
+        return "unknown"
+
+def reset_profile(reason):
+    print(f"profile: resetting ({reason})")
+    shutil.rmtree(PROFILE_DIR, ignore_errors=True)
+
+def profile_is_healthy():
+    # The marker is written only after a clean shutdown with the same Playwright build;
+    # Chromium's own JSON state files must also parse.
+    try:
+        marker = json.loads(PROFILE_MARKER.read_text())
+        if marker.get("playwright") != _playwright_version():
+            return False
+        for name in ("Local State", "Default/Preferences"):
+            json.loads((PROFILE_DIR / name).read_text(encoding="utf-8"))
+        return True
+    except Exception:
+        return False
+
+def prepare_profile():
+    # Returns True if a usable cached profile is in place, False for a clean one.
+    if not PROFILE_DIR.exists():
+        return False
+    if not profile_is_healthy():
+        reset_profile("missing or corrupt")
+        return False
+    for name in PROFILE_LOCKS:
+        try:
+            (PROFILE_DIR / name).unlink()
+        except OSError:
+            pass
+    size = _dir_size_mb(PROFILE_DIR)
+    if size > PROFILE_MAX_MB:
+        print(f"profile: {size:.0f}MB over {PROFILE_MAX_MB}MB, pruning caches")
+        for rel in PROFILE_PRUNABLE:
+            shutil.rmtree(PROFILE_DIR / rel, ignore_errors=True)
+        if _dir_size_mb(PROFILE_DIR) > PROFILE_MAX_MB:
+            reset_profile("still over size limit")
+            return False
+    # from here until a clean shutdown the profile is in an unknown state
+    PROFILE_MARKER.unlink(missing_ok=True)
+    return True
+
+def mark_profile_healthy():
+    try:
+        PROFILE_MARKER.write_text(json.dumps({"playwright": _playwright_version(), "saved": time.time()}))
+    except Exception as exc:
+        print(f"profile marker write failed: {exc}")
+
+def restore_storage_state(context, cached_profile):
+    # launch_persistent_context has no storage_state argument: cookies are re-applied each
+    # run (the repo copy is authoritative), localStorage only seeds a clean profile.
+    if not STATE_FILE.exists():
+        return
+    try:
+        state = json.loads(STATE_FILE.read_text())
+    except Exception as exc:
+        print(f"storage state restore failed: {exc}")
+        return
+    if state.get("cookies"):
+        context.add_cookies(state["cookies"])
+    if cached_profile:
+        return
+    for origin in state.get("origins", []):
+        items = {i["name"]: i["value"] for i in origin.get("localStorage", [])}
+        if items:
+            context.add_init_script(
+                "(() => { try { if (location.origin !== %s) return; const items = %s;"
+                " for (const k in items) { if (localStorage.getItem(k) === null) localStorage.setItem(k, items[k]); }"
+                " } catch (e) {} })();" % (json.dumps(origin["origin"]), json.dumps(items))
+            )
+
 def new_context(p):
+    # Returns (browser, context); browser is None when a persistent profile is in use.
     ua = random.choice(USER_AGENTS)
     vp = {
         "width": random.choice([1280, 1366, 1440, 1536]),
         "height": random.choice([760, 800, 864, 900])
     }
-    browser = p.chromium.launch(headless=True)
     ensure_artifact_dirs()
     args = {"user_agent": ua, "viewport": vp, "locale": "en-GB", "record_video_dir": str(VIDEO_TEMP_DIR)}
-    if STATE_FILE.exists():
-        args["storage_state"] = str(STATE_FILE)
-    context = browser.new_context(**args)
+    context = None
+    browser = None
+    if USE_PERSISTENT_PROFILE:
+        cache_args = [f"--disk-cache-size={PROFILE_DISK_CACHE_MB * 1024 * 1024}"]
+        for _ in range(2):
+            cached = prepare_profile()
+            try:
+                context = p.chromium.launch_persistent_context(
+                    str(PROFILE_DIR), headless=True, args=cache_args, **args
+                )
+                print(f"profile: using {'cached' if cached else 'clean'} profile")
+                restore_storage_state(context, cached)
+                break
+            except Exception as exc:
+                print(f"profile: launch failed ({exc})")
+                if context is not None:
+                    try:
+                        context.close()
+                    except Exception:
+                        pass
+                    context = None
+                reset_profile("launch failed")
+    if context is None:
+        browser = p.chromium.launch(headless=True)
+        if STATE_FILE.exists():
+            args["storage_state"] = str(STATE_FILE)
+        context = browser.new_context(**args)
     context.add_init_script("try{ sessionStorage.setItem('setPhoneLogin','false'); }catch(e){}")
     context.set_extra_http_headers({"Accept-Language": "en-GB,en;q=0.9"})
     return browser, context
@@ -108,6 +530,10 @@ class CaptchaError(Exception):
     pass
 
 
+class OutOfTime(Exception):
+    pass
+
+
 def detect_captcha(page):
     selectors = [
         "iframe[src*='captcha' i]",
@@ -156,42 +582,13 @@ def perform_login(page):
     pw = os.environ["ALLOCATE_PASS"]
 
     start_time = time.monotonic()
-    deadline = start_time + 90
+    deadline = start_time + min(90, run_deadline.remaining())
     bounce_retry_used = False
+    selector_cache = load_selector_cache()
 
-    def visible_or_none(locator):
-        try:
-            count = locator.count()
-        except Exception:
-            return None
-        for i in range(count):
-            candidate = locator.nth(i)
-            try:
-                if candidate.is_visible():
-                    return candidate
-            except Exception:
-                continue
-        return None
-
-    def find_visible_input(selectors, container=None):
-        for sel in selectors:
-            scopes = []
-            if container is not None:
-                scopes.append(container.locator(sel))
-            scopes.append(page.locator(sel))
-            for scope in scopes:
-                try:
-                    count = scope.count()
-                except Exception:
-                    continue
-                for idx in range(count):
-                    candidate = scope.nth(idx)
-                    try:
-                        candidate.wait_for(state="visible", timeout=60000)
-                        return candidate
-                    except Exception:
-                        continue
-        return None
+    def wait_budget_ms(cap_ms):
+        time_left = deadline - time.monotonic()
+        return int(min(cap_ms, max(0, time_left * 1000)))
 
     while True:
         if time.monotonic() > deadline:
@@ -202,8 +599,8 @@ def perform_login(page):
             capture_artifacts(page, "after_login")
             raise CaptchaError("CAPTCHA encountered during login")
 
-        welcome_login_btn = visible_or_none(
-            page.get_by_role("button", name=re.compile("log.?in", re.I))
+        welcome_login_btn = resolve_visible(
+            "welcome", WELCOME_SELECTORS, [page], 0, selector_cache
         )
         if welcome_login_btn is not None:
             capture_artifacts(page, "welcome")
@@ -255,15 +652,8 @@ def perform_login(page):
         container_candidates = page.locator(container_selector)
         auth0_container = container_candidates.first if container_candidates.count() > 0 else None
 
-        email_input = find_visible_input(
-            [
-                "input[type='email']",
-                "input[name='email']",
-                "input[autocomplete='username']",
-                "input[type='text'][name='username']",
-                ".auth0-lock-input input",
-            ],
-            container=auth0_container,
+        email_input = resolve_visible(
+            "email", EMAIL_SELECTORS, [auth0_container, page], wait_budget_ms(15000), selector_cache
         )
         if email_input is None:
             toggle = page.locator("#btnLoginPhone, button:has-text('Login with username'), button:has-text('Login with phone number')")
@@ -294,15 +684,8 @@ def perform_login(page):
                     auth0_container = (
                         container_candidates.first if container_candidates.count() > 0 else None
                     )
-                    email_input = find_visible_input(
-                        [
-                            "input[type='email']",
-                            "input[name='email']",
-                            "input[autocomplete='username']",
-                            "input[type='text'][name='username']",
-                            ".auth0-lock-input input",
-                        ],
-                        container=auth0_container,
+                    email_input = resolve_visible(
+                        "email", EMAIL_SELECTORS, [auth0_container, page], wait_budget_ms(15000), selector_cache
                     )
             except Exception:
                 pass
@@ -311,13 +694,8 @@ def perform_login(page):
             capture_artifacts(page, "after_login")
             raise AuthError("Email input not found")
 
-        password_input = find_visible_input(
-            [
-                "input[type='password']",
-                "input[name='password']",
-                ".auth0-lock-input input[type='password']",
-            ],
-            container=auth0_container,
+        password_input = resolve_visible(
+            "password", PASSWORD_SELECTORS, [auth0_container, page], wait_budget_ms(15000), selector_cache
         )
         if password_input is None:
             capture_artifacts(page, "auth0_debug")
@@ -325,7 +703,7 @@ def perform_login(page):
             raise AuthError("Password input not found")
 
         try:
-            email_input.wait_for(state="visible", timeout=60000)
+            email_input.wait_for(state="visible", timeout=max(1000, wait_budget_ms(10000)))
             email_input.click()
             micro_pause()
             email_input.fill(user)
@@ -335,7 +713,7 @@ def perform_login(page):
             raise AuthError(f"Unable to fill email input: {exc}")
 
         try:
-            password_input.wait_for(state="visible", timeout=60000)
+            password_input.wait_for(state="visible", timeout=max(1000, wait_budget_ms(10000)))
             password_input.click()
             password_input.fill("")
             password_input.type(pw, delay=random.randint(40, 110))
@@ -346,30 +724,16 @@ def perform_login(page):
 
         capture_artifacts(page, "auth0_filled")
 
-        login_button = None
-        login_candidates = [
-            page.get_by_role("button", name=re.compile("^log.?in$", re.I)),
-            page.locator(".auth0-lock-submit button"),
-            page.locator("button[type='submit']"),
-        ]
-        if auth0_container is not None:
-            login_candidates = [
-                auth0_container.get_by_role("button", name=re.compile("^log.?in$", re.I)),
-                auth0_container.locator(".auth0-lock-submit button"),
-                auth0_container.locator("button[type='submit']"),
-            ] + login_candidates
-        for candidate in login_candidates:
-            locator = visible_or_none(candidate)
-            if locator is not None:
-                login_button = locator
-                break
+        login_button = resolve_visible(
+            "submit", SUBMIT_SELECTORS, [auth0_container, page], wait_budget_ms(5000), selector_cache
+        )
         if login_button is None:
             capture_artifacts(page, "auth0_debug")
             capture_artifacts(page, "after_login")
             raise AuthError("Login button not found")
 
         try:
-            login_button.wait_for(state="visible", timeout=60000)
+            login_button.wait_for(state="visible", timeout=max(1000, wait_budget_ms(10000)))
             login_button.click()
             print("login: submitted")
         except Exception as exc:
@@ -433,31 +797,22 @@ def perform_login(page):
                 return True
 
             error_message = None
-            error_sources = []
-            if auth0_container is not None:
-                error_sources.append(auth0_container)
-            error_sources.append(page.locator(".auth0-lock"))
-            error_sources.append(page)
-            for source in error_sources:
+            error_el = resolve_visible(
+                "error", ERROR_SELECTORS, [auth0_container, page.locator(".auth0-lock"), page], 0, selector_cache
+            )
+            if error_el is not None:
                 try:
-                    error_candidate = source.locator("text=/(invalid|wrong|try again)/i")
-                    if error_candidate.count() > 0:
-                        candidate = visible_or_none(error_candidate)
-                        if candidate is not None:
-                            text = candidate.inner_text().strip()
-                            if text:
-                                error_message = text
-                                break
+                    error_message = error_el.inner_text().strip()
                 except Exception:
-                    continue
+                    pass
             if error_message:
                 maybe_capture_post_submit(force=True)
                 capture_artifacts(page, "after_login")
                 raise AuthError(f"Login error: {error_message}")
 
             if not bounce_retry_used and now - submit_time >= 20:
-                welcome_again = visible_or_none(
-                    page.get_by_role("button", name=re.compile("log.?in", re.I))
+                welcome_again = resolve_visible(
+                    "welcome", WELCOME_SELECTORS, [page], 0, selector_cache
                 )
                 if welcome_again is not None:
                     print("login: bounce detected, retrying welcome card")
@@ -477,7 +832,7 @@ def perform_login(page):
             continue
 
 
-def ensure_authenticated(page, context, relog_state, force=False):
+def ensure_authenticated(page, context, relog_state, force=False, state=None):
     try:
         login_required = needs_login(page)
     except CaptchaError:
@@ -490,9 +845,13 @@ def ensure_authenticated(page, context, relog_state, force=False):
         raise CaptchaError("CAPTCHA encountered")
     if relog_state.get("attempted"):
         raise AuthError("Authentication required again after retry")
+    if run_deadline.remaining() < LOGIN_MIN_SECONDS:
+        # not a credentials problem; stop like any other budget stop
+        raise OutOfTime(f"only {run_deadline.remaining():.0f}s left, too little to log in")
     relog_state["attempted"] = True
     perform_login(page)
-    context.storage_state(path=str(STATE_FILE))
+    if state is not None:
+        state.capture_session(context)
     micro_pause()
 
 def go_to_available_duties(page, keep_auth):
@@ -503,17 +862,17 @@ def go_to_available_duties(page, keep_auth):
     # Temporarily skip in-app navigation — go straight to the known BankShifts URL after login.
     bank_href = f"{BASE_URL}/EmployeeOnlineHealth/GGCLIVE/Roster/BankShifts"
     log("skipping menu navigation; loading BankShifts URL directly")
-    page.goto(bank_href, wait_until="networkidle", timeout=30000)
+    page.goto(bank_href, wait_until="networkidle", timeout=run_deadline.wait_ms(30000))
     # Wait for the bank duties table/ grid to render (or the "Choose Period" control).
     page.wait_for_load_state("domcontentloaded")
 
     # Prefer the grid/table; this uses only CSS so commas are fine.
     table_like = page.locator(":is([role='grid'], [role='table'], table)").first
     try:
-        table_like.wait_for(state="visible", timeout=25_000)
+        table_like.wait_for(state="visible", timeout=run_deadline.wait_ms(25_000))
     except Exception:
         # Fallback: wait for the "Choose Period" control by text, using the text engine (separate locator)
-        page.get_by_text("Choose Period", exact=False).wait_for(timeout=10_000)
+        page.get_by_text("Choose Period", exact=False).wait_for(timeout=run_deadline.wait_ms(10_000))
     keep_auth()
 
 
@@ -530,7 +889,7 @@ def read_table_headers(table_locator):
 
 def read_table_rows(page):
     table = _find_bank_table(page)
-    table.wait_for(state="visible", timeout=15_000)
+    table.wait_for(state="visible", timeout=run_deadline.wait_ms(15_000))
 
     # Build header → index map
     headers = read_table_headers(table)
@@ -563,11 +922,28 @@ def read_table_rows(page):
         rows.append(row)
     return rows
 
-def paginate_collect(page, keep_auth):
-    all_rows = []
+def paginate_collect(page, keep_auth, progress=None, on_page=None):
+    # Generator: rows are yielded page by page so alerts don't wait for the whole scrape.
+    # `progress["pages_done"]` on entry skips pages a previous run already read; on exit
+    # `progress["complete"]` says whether we reached the last page or ran out of time.
+    progress = progress if progress is not None else {}
+    skip = progress.get("pages_done", 0)
+    progress["complete"] = False
+    page_no = 0
     while True:
         keep_auth()
-        all_rows.extend(read_table_rows(page))
+        if page_no >= skip:
+            try:
+                rows = read_table_rows(page)
+            except PWTimeout:
+                # table never rendered in time; leave the period for the next run
+                print(f"pagination: table wait timed out on page {page_no + 1}")
+                break
+            yield from rows
+        page_no += 1
+        progress["pages_done"] = max(skip, page_no)
+        if on_page is not None and page_no >= skip:
+            on_page(progress)
         # try to find a "Next" control; various Allocate themes vary
         next_btn = page.get_by_role("button", name=re.compile(r"(next|›|>)", re.I))
         # If there are numbered pages, click the next numeric if present
@@ -575,16 +951,20 @@ def paginate_collect(page, keep_auth):
             # fallback: find a button with aria-label next
             next_btn = page.locator("[aria-label*='Next' i]")
         if next_btn.count() == 0 or ("disabled" in (next_btn.get_attribute("class") or "").lower()):
+            progress["complete"] = True
+            break
+        if page_no >= skip and run_deadline.expired():
             break
         try:
             next_btn.first.click(timeout=1500)
             micro_pause()
-            page.wait_for_load_state("networkidle")
+            page.wait_for_load_state("networkidle", timeout=run_deadline.wait_ms(30000))
             table = _find_bank_table(page)
-            table.wait_for(state="visible", timeout=15_000)
+            table.wait_for(state="visible", timeout=run_deadline.wait_ms(15_000))
         except Exception:
+            # e.g. networkidle timing out near the deadline: leave the period incomplete
+            # so the next run resumes it from pages_done
             break
-    return all_rows
 
 def get_period_widget(page):
     # Support either <select> or a button that opens a listbox
@@ -619,20 +999,121 @@ def select_period(page, widget, item):
         micro_pause()
         page.get_by_role("option", name=re.compile(re.escape(item), re.I)).click()
     micro_pause()
-    page.wait_for_load_state("networkidle")
+    page.wait_for_load_state("networkidle", timeout=run_deadline.wait_ms(30000))
     table = _find_bank_table(page)
-    table.wait_for(state="visible", timeout=15_000)
+    table.wait_for(state="visible", timeout=run_deadline.wait_ms(15_000))
+
+def period_label(item):
+    return item["label"] if isinstance(item, dict) else item
+
+_DATE_PATTERNS = [
+    (re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b"), lambda m: date(int(m[1]), int(m[2]), int(m[3]))),
+    (re.compile(r"\b(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})\b"), lambda m: date(int(m[3]), int(m[2]), int(m[1]))),
+    (re.compile(r"\b(\d{1,2})(?:st|nd|rd|th)?\s+([A-Za-z]{3,9})\.?,?\s+(\d{4})\b"),
+     lambda m: datetime.strptime(f"{m[1]} {m[2][:3]} {m[3]}", "%d %b %Y").date()),
+]
 
-def scrape_all_periods(page, keep_auth):
+def parse_period_range(label):
+    # Allocate labels look like "13/10/2025 - 09/11/2025" or "13 Oct 2025 - 9 Nov 2025";
+    # returns (start, end) or None unless the label carries two recognisable dates.
+    # A single date ("w/c 13/10/2025") says nothing about the end, so it isn't pruned.
+    found = []
+    for rx, build in _DATE_PATTERNS:
+        for m in rx.finditer(label or ""):
+            try:
+                found.append((m.start(), build(m)))
+            except ValueError:
+                continue
+    dates = [d for _, d in sorted(found)]
+    if len(dates) < 2:
+        return None
+    return dates[0], dates[-1]
+
+def plan_periods(options, cfg, stats, today=None):
+    # Drop periods outside the configured window, then order the rest by value.
+    today = today or date.today()
+    earliest = today - timedelta(days=int(cfg["days_back"]))
+    latest = today + timedelta(days=int(cfg["horizon_days"]))
+    planned = []
+    for pos, item in enumerate(options):
+        label = period_label(item)
+        rng = parse_period_range(label)
+        if rng is None:
+            # unknown format: keep it, but after anything we can place in time
+            planned.append((float("inf"), pos, item))
+            continue
+        start, end = rng
+        if end < earliest or start > latest:
+            print(f"periods: skipping '{label}' (outside window)")
+            continue
+        distance = 0 if start <= today <= end else min(abs((start - today).days), abs((end - today).days))
+        planned.append((distance, pos, item))
+
+    order = cfg["order"]
+    if order == "page":
+        planned.sort(key=lambda t: t[1])
+    elif order == "nearest":
+        planned.sort(key=lambda t: (t[0], t[1]))
+    else:
+        planned.sort(key=lambda t: (-period_score(stats, period_label(t[2]), today), t[0], t[1]))
+    return [item for _, _, item in planned]
+
+def scrape_all_periods(page, keep_auth, cfg=None, stats=None, checkpoint=None, after_page=None):
+    # The `rescan_top` highest-ranked periods are scraped every run; after them, periods
+    # and pages finished by an earlier, interrupted run are skipped. Once every planned
+    # period is done, checkpoint["complete"] is set. `after_page` runs once each
+    # page's rows have been consumed, before the next page is requested.
+    cfg = cfg or dict(PERIOD_DEFAULTS)
+    checkpoint = checkpoint if checkpoint is not None else empty_checkpoint()
     widget = get_period_widget(page)
-    options = widget[2]
-    all_rows = []
-    for item in options:
+    options = plan_periods(widget[2], cfg, stats or {})
+    done = set(checkpoint["periods_done"])
+    current = checkpoint.get("current") or {}
+    head = options[:int(cfg.get("rescan_top") or 0)]
+    head_labels = {period_label(i) for i in head}
+    rest = [i for i in options if period_label(i) not in head_labels and period_label(i) not in done]
+    # then finish the period the last run stopped in before starting new ones
+    rest.sort(key=lambda i: period_label(i) != current.get("period"))
+    todo = head + rest
+    print(f"periods: scraping {len(todo)} of {len(widget[2])} "
+          f"({len(head)} top-ranked, {len(options) - len(head) - len(rest)} done by earlier run)")
+    budget = cfg.get("time_budget_seconds")
+    started = time.monotonic()
+    for n, item in enumerate(todo):
+        if (budget and time.monotonic() - started > float(budget)) or run_deadline.expired(margin=PERIOD_SWITCH_SECONDS):
+            dropped = [period_label(i) for i in todo[n:]]
+            print(f"periods: out of time, leaving {len(dropped)} low-value period(s) for the next run: {dropped}")
+            return
+        label = period_label(item)
+        resuming = current.get("period") == label and label not in head_labels
+        progress = {"pages_done": current.get("pages_done", 0) if resuming else 0}
         keep_auth()
-        select_period(page, widget, item)
+        try:
+            select_period(page, widget, item)
+        except PWTimeout:
+            print(f"periods: timed out switching to '{label}', resuming it next run")
+            checkpoint["current"] = {"period": label, "pages_done": progress["pages_done"]}
+            save_checkpoint(checkpoint)
+            return
         keep_auth()
-        all_rows.extend(paginate_collect(page, keep_auth))
-    return all_rows
+
+        def on_page(progress, label=label):
+            if after_page is not None:
+                after_page()
+            checkpoint["current"] = {"period": label, "pages_done": progress["pages_done"]}
+            save_checkpoint(checkpoint)
+
+        for r in paginate_collect(page, keep_auth, progress, on_page):
+            r["period"] = label
+            yield r
+        if not progress["complete"]:
+            print(f"periods: out of time in '{label}' after {progress['pages_done']} page(s)")
+            return
+        if label not in checkpoint["periods_done"]:
+            checkpoint["periods_done"].append(label)
+        checkpoint["current"] = None
+        save_checkpoint(checkpoint)
+    checkpoint["complete"] = True
 
 def match_action(r, rules):
     def in_list(val, arr):
@@ -652,11 +1133,106 @@ def match_action(r, rules):
             return rule.get("action", "ignore")
     return "ignore"
 
+ALERT_DEBOUNCE_SECONDS = 10    # batch alerts that arrive close together into one email
+
+ALERT_GROUPS = {
+    "priority": ("🔥 New priority shifts ({n})", "Priority"),
+    "late":     ("🌙 New late/night shifts ({n})", "Late/Night"),
+}
+
+class AlertPipeline:
+    # Streaming dedup -> match_action -> debounced email stage. An ID is only added
+    # to `seen` once its alert has gone out, so a crash mid-scrape never loses one.
+    # Seen IDs live in the StateManager; they are written right after an email is
+    # sent (so a killed run can't re-send it) and otherwise at the end of the run.
+    def __init__(self, rules, state, debounce_seconds=ALERT_DEBOUNCE_SECONDS):
+        self.rules = rules
+        self.state = state
+        self.seen = state.seen
+        self.debounce_seconds = debounce_seconds
+        self.pending = {action: [] for action in ALERT_GROUPS}
+        self.pending_ids = set()
+        self.pending_since = None
+        self.period_hits = {}
+
+    def process(self, row):
+        rid = row.get("request_id")
+        if not rid:
+            return
+        action = match_action(row, self.rules)
+        if rid in self.seen or rid in self.pending_ids:
+            return
+        if action in self.pending:
+            self.pending[action].append(row)
+            self.pending_ids.add(rid)
+            if self.pending_since is None:
+                self.pending_since = time.monotonic()
+        else:
+            self.seen.add(rid)
+        self.tick()
+
+    def tick(self):
+        if self.pending_since is not None and time.monotonic() - self.pending_since >= self.debounce_seconds:
+            self.flush()
+
+    def pending_rows(self):
+        return [r for rows in self.pending.values() for r in rows]
+
+    def page_done(self):
+        # Called between pages, since rows within a page arrive too fast for tick() to
+        # ever see the debounce expire. A failed send resets pending_since, so this
+        # also spaces out retries; the final flush() sends whatever is left.
+        self.tick()
+
+    def flush(self):
+        # Send failures are logged and the rows stay pending for the next attempt, so an
+        # SMTP hiccup never aborts the scrape. Returns True if nothing is left pending.
+        failed = False
+        for action, (subject, heading) in ALERT_GROUPS.items():
+            rows = self.pending[action]
+            if not rows:
+                continue
+            try:
+                send_email(
+                    subject=subject.format(n=len(rows)),
+                    html=f"<h3>{heading}</h3>{fmt_ul(rows)}"
+                )
+            except Exception as exc:
+                print(f"alert email failed ({action}, {len(rows)} row(s)), will retry: {exc}")
+                failed = True
+                continue
+            ids = {r["request_id"] for r in rows}
+            if action == "priority":
+                # only newly alerted shifts count, not ones still listed from earlier runs
+                for r in rows:
+                    if r.get("period"):
+                        self.period_hits[r["period"]] = self.period_hits.get(r["period"], 0) + 1
+            self.seen |= ids
+            self.pending_ids -= ids
+            self.pending[action] = []
+            self.state.commit_seen()
+        if failed:
+            # restart the debounce so the retry waits instead of firing on the next row
+            self.pending_since = time.monotonic()
+            return False
+        self.pending_since = None
+        return True
+
 def main():
+    run_deadline.start(RUN_BUDGET_SECONDS)
     jitter_sleep()
 
     rules = load_rules()
-    seen = load_seen()
+    period_cfg = load_period_config()
+    period_stats = load_period_stats()
+    state = StateManager()
+    pipeline = AlertPipeline(rules, state)
+    checkpoint = load_checkpoint()
+    if checkpoint["rows"]:
+        # replay rows from an interrupted run: re-alerts anything whose email never went out
+        print(f"checkpoint: resuming with {len(checkpoint['rows'])} unalerted row(s), {len(checkpoint['periods_done'])} period(s) done")
+        for row in checkpoint["rows"]:
+            pipeline.process(row)
 
     relog_state = {"attempted": False}
 
@@ -667,7 +1243,8 @@ def main():
             context.tracing.start(screenshots=True, snapshots=True, sources=False)
         except Exception as _exc:
             print(f"trace start failed: {_exc}")
-        page = context.new_page()
+        # launch_persistent_context opens a page already; a second one would record a stray video
+        page = context.pages[0] if browser is None and context.pages else context.new_page()
         ensure_artifact_dirs()
         console_log_path = ARTIFACTS_DIR / "browser-console.log"
         console_log_path.write_text("", encoding="utf-8")
@@ -685,19 +1262,32 @@ def main():
         page.on("console", append_console)
         page_video = getattr(page, "video", None)
         try:
-            page.goto(START_URL, wait_until="networkidle", timeout=60000)
+            run_deadline.phase("login", PHASE_BUDGETS["login"])
+            page.goto(START_URL, wait_until="networkidle", timeout=run_deadline.wait_ms(60000))
             micro_pause()
-            ensure_authenticated(page, context, relog_state, force=True)
-            context.storage_state(path=str(STATE_FILE))
+            ensure_authenticated(page, context, relog_state, force=True, state=state)
+            state.capture_session(context)
 
             def keep_auth():
-                ensure_authenticated(page, context, relog_state)
+                ensure_authenticated(page, context, relog_state, state=state)
 
             keep_auth()
+            run_deadline.phase("navigate", PHASE_BUDGETS["navigate"])
             go_to_available_duties(page, keep_auth)
             keep_auth()
-            rows = scrape_all_periods(page, keep_auth)
-            context.storage_state(path=str(STATE_FILE))
+            run_deadline.phase("scrape", PHASE_BUDGETS["scrape"])
+
+            def after_page():
+                pipeline.page_done()
+                # the checkpoint only needs rows whose alert hasn't gone out yet
+                checkpoint["rows"] = pipeline.pending_rows()
+
+            # Each row is deduped, matched and queued for alerting as soon as it is read.
+            for row in scrape_all_periods(page, keep_auth, period_cfg, period_stats, checkpoint,
+                                          after_page=after_page):
+                pipeline.process(row)
+            pipeline.flush()
+            state.capture_session(context)
         except CaptchaError as ce:
             send_email("⚠️ CAPTCHA encountered – manual login needed", f"<p>{str(ce)}</p>")
             raise
@@ -705,11 +1295,39 @@ def main():
             send_email("⚠️ Re-auth required (Loop)",
                        f"<p>{str(ae)}</p><p><a href='{START_URL}'>Log in to Loop</a></p>")
             raise
+        except OutOfTime as exc:
+            # checkpoint and pending alerts are saved below; the next run carries on
+            print(f"deadline: {exc}; stopping early")
         finally:
+            # Alert on whatever was gathered before a failure; no-op after a clean flush.
+            try:
+                pipeline.flush()
+            except Exception as exc:
+                print(f"alert flush failed: {exc}")
+            try:
+                final = empty_checkpoint() if checkpoint.get("complete") else checkpoint
+                final["rows"] = pipeline.pending_rows()
+                save_checkpoint(final)
+            except Exception as exc:
+                print(f"checkpoint save failed: {exc}")
+            # Single end-of-run write of seen IDs and session, skipped if nothing changed.
+            try:
+                state.commit()
+            except Exception as exc:
+                print(f"state save failed: {exc}")
+            # hits from alerts already sent count even if the run failed afterwards
+            try:
+                save_period_stats(update_period_stats(period_stats, pipeline.period_hits))
+            except Exception as exc:
+                print(f"period stats save failed: {exc}")
             try:
                 context.close()
+                if browser is None:
+                    # persistent profile shut down cleanly; trust it next run
+                    mark_profile_healthy()
             finally:
-                browser.close()
+                if browser is not None:
+                    browser.close()
             if page_video is not None:
                 try:
                     raw_path = Path(page_video.path())
@@ -730,39 +1348,6 @@ def main():
             except Exception as _exc:
                 print(f"trace save failed: {_exc}")
 
-    # Deduplicate & detect new
-    current_ids = {r.get("request_id") for r in rows if r.get("request_id")}
-    new_rows = [r for r in rows if r.get("request_id") and r["request_id"] not in seen]
-
-    if not new_rows:
-        # nothing new → just update seen and exit quietly
-        save_seen(current_ids | seen)
-        return
-
-    # Apply rules
-    priority = []
-    late = []
-    for r in new_rows:
-        action = match_action(r, rules)
-        if action == "priority":
-            priority.append(r)
-        elif action == "late":
-            late.append(r)
-
-    # Only email if at least one group has content
-    if priority:
-        send_email(
-            subject=f"🔥 New priority shifts ({len(priority)})",
-            html=f"<h3>Priority</h3>{fmt_ul(priority)}"
-        )
-    if late:
-        send_email(
-            subject=f"🌙 New late/night shifts ({len(late)})",
-            html=f"<h3>Late/Night</h3>{fmt_ul(late)}"
-        )
-
-    save_seen(current_ids | seen)
-
 if __name__ == "__main__":
     try:
         main()